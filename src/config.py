@@ -21,6 +21,7 @@ class Config:
     accounts: list[NalunchCredentials]
     allowed_chat_ids: set[int]
     known_vending_devices: list[KnownVendingDevice]
+    ledger_path: str
 
 
 def parse_config(path: str) -> Config:
@@ -36,4 +37,5 @@ def parse_config(path: str) -> Config:
         accounts=accounts,
         allowed_chat_ids=set(data["allowed_chat_ids"]),
         known_vending_devices=known_vendings,
+        ledger_path=data.get("ledger_path", "ledger.db"),
     )
@@ -0,0 +1,126 @@
+import sqlite3
+from dataclasses import dataclass
+from datetime import date, datetime, timedelta
+from typing import Optional
+
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS payments (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    account TEXT NOT NULL,
+    ts TEXT NOT NULL,
+    kind TEXT NOT NULL,
+    amount INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS payments_account_ts ON payments (account, ts);
+
+CREATE TABLE IF NOT EXISTS balance_snapshots (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    account TEXT NOT NULL,
+    ts TEXT NOT NULL,
+    balance INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS balance_snapshots_account_ts ON balance_snapshots (account, ts);
+
+CREATE TABLE IF NOT EXISTS daily_spend (
+    account TEXT NOT NULL,
+    day TEXT NOT NULL,
+    amount INTEGER NOT NULL,
+    payments INTEGER NOT NULL,
+    PRIMARY KEY (account, day)
+);
+"""
+
+
+@dataclass
+class AccountStats:
+    account: str
+    today: int
+    week: int
+    daily_average: float
+    balance: Optional[int]
+    balance_time: Optional[datetime]
+
+    def days_left(self) -> Optional[float]:
+        if self.balance is None or self.daily_average <= 0:
+            return None
+        return self.balance / self.daily_average
+
+
+class SpendingLedger:
+    path: str
+    conn: sqlite3.Connection
+
+    def __init__(self, path: str):
+        self.path = path
+        self.conn = sqlite3.connect(path)
+        self.conn.executescript(SCHEMA)
+
+    def record_payment(self, account: str, kind: str, amount: int):
+        now = datetime.now()
+        with self.conn:
+            self.conn.execute(
+                "INSERT INTO payments (account, ts, kind, amount) VALUES (?, ?, ?, ?)",
+                (account, now.isoformat(), kind, amount),
+            )
+            self.conn.execute(
+                "INSERT INTO daily_spend (account, day, amount, payments) VALUES (?, ?, ?, 1) "
+                "ON CONFLICT (account, day) DO UPDATE SET "
+                "amount = amount + excluded.amount, payments = payments + 1",
+                (account, now.date().isoformat(), amount),
+            )
+
+    def record_balance(self, account: str, balance: int):
+        with self.conn:
+            self.conn.execute(
+                "INSERT INTO balance_snapshots (account, ts, balance) VALUES (?, ?, ?)",
+                (account, datetime.now().isoformat(), balance),
+            )
+
+    def last_balance(self, account: str):
+        row = self.conn.execute(
+            "SELECT ts, balance FROM balance_snapshots WHERE account = ? ORDER BY ts DESC, id DESC LIMIT 1",
+            (account,),
+        ).fetchone()
+        if row is None:
+            return None, None
+        return int(row[1]), datetime.fromisoformat(row[0])
+
+    def account_stats(self, account: str, today: Optional[date] = None) -> AccountStats:
+        today = today or date.today()
+        week_start = today - timedelta(days=today.weekday())
+        window_start = today - timedelta(days=6)
+
+        days = dict(
+            self.conn.execute(
+                "SELECT day, amount FROM daily_spend WHERE account = ? AND day >= ?",
+                (account, min(week_start, window_start).isoformat()),
+            ).fetchall()
+        )
+        balance, balance_time = self.last_balance(account)
+        # Payments made after the last snapshot are not reflected in it yet.
+        if balance is not None:
+            balance -= self.spent_since(account, balance_time)
+
+        spent_today = days.get(today.isoformat(), 0)
+        spent_week = sum(amount for day, amount in days.items() if day >= week_start.isoformat())
+        spent_window = sum(amount for day, amount in days.items() if day >= window_start.isoformat())
+
+        return AccountStats(
+            account=account,
+            today=spent_today,
+            week=spent_week,
+            daily_average=spent_window / 7,
+            balance=balance,
+            balance_time=balance_time,
+        )
+
+    def spent_since(self, account: str, since: datetime) -> int:
+        row = self.conn.execute(
+            "SELECT COALESCE(SUM(amount), 0) FROM payments WHERE account = ? AND ts > ?",
+            (account, since.isoformat()),
+        ).fetchone()
+        return int(row[0])
+
+    def close(self):
+        self.conn.close()
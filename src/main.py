@@ -1,6 +1,7 @@
 import argparse
 
 from config import parse_config
+from ledger import SpendingLedger
 from nalunch import NalunchAccount
 from tg import NalunchTelegramBot
 
@@ -24,7 +25,8 @@ if __name__ == '__main__':
             print(account, e)
             raise e
     
-    bot = NalunchTelegramBot(config.telegram_token, config.allowed_chat_ids, accounts, config.known_vending_devices)
+    ledger = SpendingLedger(config.ledger_path)
+    bot = NalunchTelegramBot(config.telegram_token, config.allowed_chat_ids, accounts, config.known_vending_devices, ledger)
 
     print("starting")
     bot.run()
@@ -20,6 +20,7 @@ import zxingcpp
 
 from nalunch import NalunchAccount, VendingItemToBuy
 from config import KnownVendingDevice
+from ledger import SpendingLedger
 
 
 qreader = QReader()
@@ -52,6 +53,68 @@ class VendingProductsCache:
             return self.cache[device_id]
 
 
+class PhotoSizeSelector:
+    min_size: int
+    min_attempts: float
+    min_success_rate: float
+    decay: float
+    explore_every: int
+    stats: dict[str, dict[int, list[float]]]
+    decodes: dict[str, int]
+
+    def __init__(
+        self,
+        min_size: int = 320,
+        min_attempts: float = 5,
+        min_success_rate: float = 0.8,
+        decay: float = 0.9,
+        explore_every: int = 10,
+    ):
+        self.min_size = min_size
+        self.min_attempts = min_attempts
+        self.min_success_rate = min_success_rate
+        self.decay = decay
+        self.explore_every = explore_every
+        # decoder -> longest photo side -> [decayed attempts, decayed successes]
+        self.stats = {}
+        self.decodes = {}
+
+    def is_adequate(self, decoder: str, size: int):
+        attempts, successes = self.stats.get(decoder, {}).get(size, [0, 0])
+        if attempts < self.min_attempts:
+            return True
+        return successes / attempts >= self.min_success_rate
+
+    def candidates(self, decoder: str, photo_sizes):
+        photo_sizes = sorted(photo_sizes, key=lambda p: p.width * p.height)
+        # Thumbnails are too small to decode, don't waste downloads on them.
+        photo_sizes = [
+            photo for photo in photo_sizes if max(photo.width, photo.height) >= self.min_size
+        ] or photo_sizes[-1:]
+        start = next(
+            (
+                i
+                for i, photo in enumerate(photo_sizes)
+                if self.is_adequate(decoder, max(photo.width, photo.height))
+            ),
+            len(photo_sizes) - 1,
+        )
+
+        # Periodically start one size below the usual one so that skipped
+        # sizes keep getting fresh samples and can become adequate again.
+        self.decodes[decoder] = self.decodes.get(decoder, 0) + 1
+        if start > 0 and self.decodes[decoder] % self.explore_every == 0:
+            start -= 1
+
+        return photo_sizes[start:]
+
+    def record(self, decoder: str, photo, success: bool):
+        size = max(photo.width, photo.height)
+        counters = self.stats.setdefault(decoder, {}).setdefault(size, [0, 0])
+        counters[0] = counters[0] * self.decay + 1
+        counters[1] = counters[1] * self.decay + (1 if success else 0)
+
+
 class MediaGroupProcessor:
     id: str
     wait_time: timedelta
@@ -92,8 +155,10 @@ class NalunchTelegramBot:
     accounts: list[NalunchAccount]
     known_vending_devices: list[KnownVendingDevice]
     chat_ids: set[int]
+    ledger: SpendingLedger
 
     vending_products: VendingProductsCache
+    photo_sizes: PhotoSizeSelector
     media_groups: dict[str, MediaGroupProcessor]
     lock: asyncio.Lock
 
@@ -103,13 +168,16 @@ class NalunchTelegramBot:
         chat_ids: set[int],
         accounts: list[NalunchAccount],
         known_vending_devices: list[KnownVendingDevice],
+        ledger: SpendingLedger,
     ):
         self.token = token
         self.accounts = accounts
         self.chat_ids = chat_ids
         self.known_vending_devices = known_vending_devices
+        self.ledger = ledger
         self.media_groups = {}
         self.vending_products = VendingProductsCache(accounts[0])
+        self.photo_sizes = PhotoSizeSelector()
         self.lock = asyncio.Lock()
 
     def acc_by_name(self, name: str):
@@ -130,6 +198,19 @@ class NalunchTelegramBot:
             raise Exception("No such known vending device id")
         return selected_vending
 
+    def record_payment(self, account: str, kind: str, amount: int):
+        # The payment has already gone through, a ledger failure must not hide that.
+        try:
+            self.ledger.record_payment(account, kind, amount)
+        except Exception as e:
+            print("ledger error: ", e)
+
+    def record_balance(self, account: str, balance: int):
+        try:
+            self.ledger.record_balance(account, balance)
+        except Exception as e:
+            print("ledger error: ", e)
+
     def balances_handler(self):
         async def wrapper(update: Update, context: CallbackContext):
             if context._chat_id not in self.chat_ids:
@@ -142,6 +223,7 @@ class NalunchTelegramBot:
 
                 for acc in self.accounts:
                     balances[acc.creds.name] = acc.get_balance()
+                    self.record_balance(acc.creds.name, balances[acc.creds.name])
 
                 message = "\n".join(
                     [f"<b>{key}</b>: <b>{value}₽</b>" for key, value in balances.items()]
@@ -154,6 +236,36 @@ class NalunchTelegramBot:
 
         return wrapper
 
+    def stats_handler(self):
+        async def wrapper(update: Update, context: CallbackContext):
+            if context._chat_id not in self.chat_ids:
+                await update.message.reply_text(f"Unknown chat id: {context._chat_id}!")
+                return
+
+            try:
+                lines = []
+                for acc in self.accounts:
+                    stats = self.ledger.account_stats(acc.creds.name)
+                    lines.append(f"<b>{stats.account}</b>")
+                    lines.append(f"Today: <b>{stats.today}₽</b>, this week: <b>{stats.week}₽</b>")
+                    lines.append(f"Average per day (7d): <b>{stats.daily_average:.0f}₽</b>")
+                    if stats.balance is None:
+                        lines.append("Balance: unknown, run /nalunch_balances")
+                    else:
+                        balance_line = f"Balance: <b>{stats.balance}₽</b> (as of {stats.balance_time:%d.%m %H:%M})"
+                        days_left = stats.days_left()
+                        if days_left is not None:
+                            balance_line += f", enough for ~<b>{days_left:.1f}</b> days"
+                        lines.append(balance_line)
+                    lines.append("")
+
+                await update.message.reply_text("\n".join(lines).strip(), parse_mode="HTML")
+            except Exception as e:
+                print("error: ", e)
+                await update.message.reply_text(f"Exception: {e}")
+
+        return wrapper
+
     async def make_account_chooser(self, update: Update, context: CallbackContext):
         keyboard = [
             [InlineKeyboardButton(acc.creds.name, callback_data=acc.creds.name)]
@@ -240,6 +352,7 @@ class NalunchTelegramBot:
                         items_to_buy = [VendingItemToBuy(id=id, count=count) for id, count in context.user_data["items_to_buy"].items()]
                         device_id = context.user_data["selected_device_id"]
                         price = selected_account.pay_vending(device_id, items_to_buy)
+                        self.record_payment(selected_account.creds.name, "vending", price)
                         await query.edit_message_text(f"Vending payment successful! Spent <b>{price}₽</b>.", parse_mode="HTML")
                     except Exception as e:
                         print("error: ", e)
@@ -254,7 +367,7 @@ class NalunchTelegramBot:
 
         return wrapper
 
-    async def parse_qr_code(self, photo):
+    async def download_image(self, photo):
         image_file = await photo.get_file()
         image_stream = io.BytesIO()
 
@@ -262,24 +375,51 @@ class NalunchTelegramBot:
         image_stream.seek(0)
 
         image = cv2.imdecode(np.frombuffer(image_stream.read(), np.uint8), 1)
-        image = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
-
-        decoded_text = qreader.detect_and_decode(image=image)
-        return decoded_text[0]
+        return cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
+
+    async def decode_photo(self, decoder: str, photo_sizes, decode: Callable):
+        """Decodes the smallest adequate photo size, escalating to larger ones on failure."""
+        for i, photo in enumerate(self.photo_sizes.candidates(decoder, photo_sizes)):
+            result = decode(await self.download_image(photo))
+            # Larger sizes are only tried after a smaller one failed, so only
+            # the first attempt is an unbiased sample for its size.
+            if i == 0:
+                self.photo_sizes.record(decoder, photo, result is not None)
+            if result is not None:
+                return result
+        return None
+
+    async def parse_qr_code(self, photo_sizes):
+        def decode(image):
+            decoded_text = qreader.detect_and_decode(image=image)
+            return decoded_text[0] if len(decoded_text) > 0 else None
+
+        result = await self.decode_photo("qr", photo_sizes, decode)
+        if result is None:
+            raise Exception("Unable to read QR code")
+        return result
+
+    async def parse_barcode(self, photo_sizes):
+        def decode(image):
+            results = zxingcpp.read_barcodes(image)
+            return results[0].text if len(results) > 0 else None
+
+        return await self.decode_photo("barcode", photo_sizes, decode)
 
     def photo_handler(self):
         async def wrapper(update: Update, context: CallbackContext):
             if context.user_data.get("awaiting_qr_bill", False):
                 msg = await update.message.reply_text("Reading QR code...")
-                path = await self.parse_qr_code(update.message.photo[-1])
-
-                await msg.edit_text("Performing payment...")
 
                 try:
+                    path = await self.parse_qr_code(update.message.photo)
+                    await msg.edit_text("Performing payment...")
+
                     selected_account = self.acc_by_name(
                         context.user_data["selected_account"]
                     )
                     price = selected_account.pay(path)
+                    self.record_payment(selected_account.creds.name, "qr", price)
                     await msg.edit_text(f"Payment successful! Spent <b>{price}₽</b>.", parse_mode="HTML")
                     context.user_data["awaiting_qr_bill"] = False
                 except Exception as e:
@@ -288,13 +428,12 @@ class NalunchTelegramBot:
             elif context.user_data.get("awaiting_vending_qr", False):
                 msg = await update.message.reply_text("Reading QR code...")
 
-                device_id = await self.parse_qr_code(update.message.photo[-1])
-
-                context.user_data["selected_device_id"] = device_id
+                try:
+                    device_id = await self.parse_qr_code(update.message.photo)
+                    context.user_data["selected_device_id"] = device_id
 
-                await msg.edit_text("Getting vending device info...")
+                    await msg.edit_text("Getting vending device info...")
 
-                try:
                     selected_account = self.acc_by_name(
                         context.user_data["selected_account"]
                     )
@@ -315,7 +454,7 @@ class NalunchTelegramBot:
                     if media_group_id not in self.media_groups:
                         self.media_groups[media_group_id] = MediaGroupProcessor(media_group_id)
 
-                await self.media_groups[media_group_id].add(update.message.photo[-1], self.media_group_callback(update, context))
+                await self.media_groups[media_group_id].add(update.message.photo, self.media_group_callback(update, context))
 
         return wrapper
 
@@ -327,22 +466,13 @@ class NalunchTelegramBot:
                 parsed_barcodes = []
                 not_parsed = []
 
-                for photo in photos:
-                    image_file = await photo.get_file()
-                    image_stream = io.BytesIO()
-
-                    await image_file.download_to_memory(image_stream)
-                    image_stream.seek(0)
-
-                    image = cv2.imdecode(np.frombuffer(image_stream.read(), np.uint8), 1)
-                    image = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
-
-                    results = zxingcpp.read_barcodes(image)
-                    if len(results) == 0:
-                        not_parsed.append(photo)
+                for photo_sizes in photos:
+                    barcode = await self.parse_barcode(photo_sizes)
+                    if barcode is None:
+                        not_parsed.append(photo_sizes[-1])
                         continue
 
-                    parsed_barcodes.append(results[0].text)
+                    parsed_barcodes.append(barcode)
 
                 context.user_data["parsed_barcodes"] += parsed_barcodes
 
@@ -390,6 +520,7 @@ class NalunchTelegramBot:
     def run(self):
         app = ApplicationBuilder().token(self.token).build()
         app.add_handler(CommandHandler("nalunch_balances", self.balances_handler()))
+        app.add_handler(CommandHandler("nalunch_stats", self.stats_handler()))
         app.add_handler(CommandHandler("nalunch_pay_vending", self.pay_vending_handler()))
         app.add_handler(CommandHandler("nalunch_pay_qr", self.pay_qr_handler()))
         app.add_handler(CallbackQueryHandler(self.callback_query_handler()))